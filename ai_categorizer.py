@@ -226,12 +226,16 @@ def get_categorization_suggestions(transaction_ids: List[int], user_id: int) ->
     Returns dict mapping transaction_id to suggested category info
     """
     
-    # Get transactions
+    # Get transactions, keeping each IN (...) list to a bounded size
     from models import Account
-    transactions = Transaction.query.join(Account).filter(
-        Transaction.id.in_(transaction_ids),
-        Account.user_id == user_id
-    ).all()
+    batch_size = 500
+    transactions = []
+    
+    for i in range(0, len(transaction_ids), batch_size):
+        transactions.extend(Transaction.query.join(Account).filter(
+            Transaction.id.in_(transaction_ids[i:i + batch_size]),
+            Account.user_id == user_id
+        ).all())
     
     if not transactions:
         return {}
@@ -1,10 +1,14 @@
 import os
 import logging
+import multiprocessing
 import secrets
+import sqlite3
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -34,10 +38,19 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:/
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    "insertmanyvalues_page_size": 5000,
 }
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
 
+@event.listens_for(Engine, "connect")
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """Use SQLite's write-ahead log, so reads (like import status polls) don't wait for a long import to commit"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
 # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
 db.init_app(app)
 
@@ -51,13 +64,65 @@ def load_user(user_id):
     from models import User
     return User.query.get(int(user_id))
 
+# Any constant works; it only has to be the same in every process running init_db()
+SCHEMA_UPGRADE_LOCK_ID = 7268123
+
+def init_db():
+    """Bring the schema up to date: create missing tables, then columns and indexes added to existing ones"""
+    from models import merge_duplicate_categories, move_legacy_backup_codes
+    
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Workers and instances starting together upgrade one at a time; the rest find nothing to do
+            connection.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': SCHEMA_UPGRADE_LOCK_ID})
+        
+        db.metadata.create_all(connection)
+        add_missing_columns(connection)
+        
+        # Categories duplicated before names were unique per user would stop that index being created
+        merge_duplicate_categories(connection)
+        # Backup codes from before they had their own table
+        move_legacy_backup_codes(connection)
+        
+        # create_all() skips existing tables, so add any indexes declared after they were created
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def add_missing_columns(connection):
+    """Add columns declared after their table was created (always as nullable, without a default)"""
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}'
+                ))
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or update the database schema (flask --app main init-db); run once before starting the server."""
+    init_db()
+    print('Database schema is up to date.')
+
+
 with app.app_context():
     # Make sure to import the models here or their tables won't be created
     import models  # noqa: F401
     import routes  # noqa: F401
     
-    db.create_all()
-    
-    # Create upload directory if it doesn't exist
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
-    os.makedirs(app.config["SESSION_FILE_DIR"], exist_ok=True)
+    # CSV parsing worker processes (csv_parsers) import the app only for its modules
+    if multiprocessing.current_process().name == 'MainProcess':
+        # Create upload directory if it doesn't exist
+        os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+        os.makedirs(app.config["SESSION_FILE_DIR"], exist_ok=True)
+        
+        # Compile the busiest pages now so the first request to each doesn't pay for it
+        for template_name in ('dashboard.html', 'transactions.html', 'accounts.html',
+                              'budgets.html', 'categories.html', 'upload.html'):
+            app.jinja_env.get_template(template_name)
@@ -5,27 +5,54 @@ from app import db
 
 def auto_categorize_transaction(description, merchant, user_id):
     """Automatically categorize a transaction based on description and merchant"""
+    return categorize_with_rules(load_category_rules(user_id), description, merchant)
+
+
+class CategoryRules:
+    """A user's compiled categorization rules plus the results already looked up with them"""
     
-    # First, check existing categorization rules
+    def __init__(self, patterns):
+        # (compiled pattern, category_id) pairs in match order
+        self.patterns = patterns
+        # Normalized search text -> category_id; statements repeat the same merchants a lot
+        self.matches = {}
+
+
+def load_category_rules(user_id):
+    """Load the user's categorization rules, compiled and in match order"""
+    # User-defined keyword rules come first, highest priority first
     rules = CategorizationRule.query.filter_by(
         user_id=user_id, 
         is_active=True
     ).order_by(CategorizationRule.priority.desc()).all()
     
-    search_text = f"{description} {merchant or ''}".lower()
-    
-    for rule in rules:
-        if rule.keyword.lower() in search_text:
-            return rule.category_id
+    compiled = [(re.compile(re.escape(rule.keyword.lower())), rule.category_id) for rule in rules]
     
     # Fallback to built-in categorization patterns
-    category_patterns = get_default_category_patterns(user_id)
+    compiled.extend(
+        (re.compile(pattern, re.IGNORECASE), category_id)
+        for pattern, category_id in get_default_category_patterns(user_id)
+    )
+    
+    return CategoryRules(compiled)
+
+
+def categorize_with_rules(rules, description, merchant):
+    """Return the category of the first rule matching the transaction, without touching the database"""
+    search_text = f"{description} {merchant or ''}".lower()
+    
+    # Only walk the rule list the first time a given text is seen
+    if search_text in rules.matches:
+        return rules.matches[search_text]
     
-    for pattern, category_id in category_patterns:
-        if re.search(pattern, search_text, re.IGNORECASE):
-            return category_id
+    match = None
+    for pattern, category_id in rules.patterns:
+        if pattern.search(search_text):
+            match = category_id
+            break
     
-    return None
+    rules.matches[search_text] = match
+    return match
 
 
 def get_default_category_patterns(user_id):
@@ -1,443 +1,523 @@
+import csv
+import importlib
+import io
+import multiprocessing
+import os
+import numpy as np
 import pandas as pd
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple, Union
+from sqlalchemy import select
 from app import db
-from models import Transaction, Account
-from categorization import auto_categorize_transaction
+from models import Transaction
+from categorization import CategoryRules, categorize_with_rules, load_category_rules
+
+
+# Rows per executemany batch when inserting imported transactions
+INSERT_BATCH_SIZE = 5000
+
+# Transaction columns written by COPY on PostgreSQL, in order
+_COPY_COLUMNS = ('account_id', 'date', 'description', 'amount', 'transaction_type',
+                 'merchant', 'category_id', 'created_at', 'is_split')
+
+# Rows read from the CSV at a time, so large files are never fully loaded into memory
+READ_CHUNK_SIZE = 10000
+
+# Uploads at least this large are parsed in worker processes; starting the pool takes
+# about a second, the time it takes to parse roughly 4MB in this process
+PARALLEL_PARSE_BYTES = 8 * 1024 * 1024
+
+# Merchant extraction patterns, compiled once at import
+_MERCHANT_PREFIX_RE = re.compile(r'^(POS MERCHANDISE|INTERNET BILL PAYMENT|PAYROLL DEPOSIT|EFT CREDIT|INTERAC E-TRANSFER|ABM WITHDRAWAL)')
+_MERCHANT_SEPARATORS = (' - ', ' / ', ' #', ' *', '  ', ',')
+# Keeps the text before the first listed separator that occurs (list order wins, not position):
+# the alternatives are tried in order and each captures lazily up to its separator
+_MERCHANT_CUT_RE = re.compile(
+    '^(?:' + '|'.join(f'(.*?){re.escape(sep)}' for sep in _MERCHANT_SEPARATORS) + ').*', re.DOTALL
+)
+_MERCHANT_CUT_REPL = ''.join(f'\\{i}' for i in range(1, len(_MERCHANT_SEPARATORS) + 1))
+
+# Bytes read from the start of an upload when detecting its format
+FORMAT_SNIFF_BYTES = 4096
+
+# Leading dates that identify headerless exports
+_AMEX_DATE_RE = re.compile(r'\d+\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)')
+_EQ_BANK_DATE_RE = re.compile(r'\d+-\w+-\d+')
+
+# Anything that isn't part of a signed number (parentheses included)
+_AMOUNT_JUNK_RE = re.compile(r'[^\d\.\-\+]')
+# Amounts written with both parentheses, e.g. ($12.34), are negative
+_PARENTHESIZED_RE = re.compile(r'\(.*\)|\).*\(', re.DOTALL)
+
+
+def clean_amounts(amounts: pd.Series) -> np.ndarray:
+    """Clean and convert a column of amount strings to integer cents (0 where unparseable)"""
+    amounts = amounts.astype(str)
+    
+    # Handle parentheses as negative
+    negative = amounts.str.contains(_PARENTHESIZED_RE, regex=True)
+    
+    # Remove currency symbols, spaces, commas and the parentheses in one pass
+    cleaned = amounts.str.replace(_AMOUNT_JUNK_RE, '', regex=True)
+    cleaned = cleaned.where(~negative, '-' + cleaned)
+    
+    dollars = pd.to_numeric(cleaned, errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.rint(dollars * 100).astype(np.int64)
+
+
+class ExistingTransactionKeys:
+    """(date, description, amount in cents) keys of an account's transactions for duplicate checks
+
+    Keys are loaded lazily for the date span the import actually covers, so a statement
+    for one month doesn't pull the account's whole history into memory.
+    """
+    
+    def __init__(self, account_id: int):
+        self.account_id = account_id
+        self.keys: Set[Tuple] = set()
+        # Inclusive date span already loaded from the database
+        self.start = None
+        self.end = None
+    
+    def cover(self, start, end) -> None:
+        """Make sure keys dated between start and end are loaded"""
+        if self.start is None:
+            self.load(Transaction.date >= start, Transaction.date <= end)
+            self.start, self.end = start, end
+            return
+        
+        # Only fetch the parts of the span that weren't loaded yet
+        if start < self.start:
+            self.load(Transaction.date >= start, Transaction.date < self.start)
+            self.start = start
+        if end > self.end:
+            self.load(Transaction.date > self.end, Transaction.date <= end)
+            self.end = end
+    
+    def load(self, *conditions) -> None:
+        """Add the keys of the account's transactions matching the given date conditions"""
+        rows = db.session.execute(
+            select(Transaction.date, Transaction.description, Transaction.amount)
+            .where(Transaction.account_id == self.account_id, *conditions)
+        ).all()
+        self.keys.update((d, desc, int(amt * 100)) for d, desc, amt in rows)
+    
+    def add(self, key: Tuple) -> None:
+        self.keys.add(key)
+    
+    def __contains__(self, key: Tuple) -> bool:
+        return key in self.keys
 
 
 class CSVParser:
     """Base class for CSV parsers"""
     
+    # Extra keyword arguments for pd.read_csv (header=None for headerless exports, usecols)
+    read_csv_options: Dict = {}
+    
     def __init__(self, bank_name: str):
         self.bank_name = bank_name
     
     def parse(self, filepath: str, account_id: int, user_id: int) -> int:
         """Parse CSV file and return number of transactions created"""
+        try:
+            transactions_created = 0
+            existing = self.load_existing_transactions(account_id)
+            rules = load_category_rules(user_id)
+            
+            # Stream the file so only a few chunks and one insert batch are held in memory
+            chunks = self.read_chunks(filepath)
+            if (os.cpu_count() or 1) > 1 and os.path.getsize(filepath) >= PARALLEL_PARSE_BYTES:
+                parsed_chunks = self.parse_chunks_in_parallel(chunks)
+            else:
+                parsed_chunks = map(self.parse_chunk, chunks)
+            
+            for parsed_rows in parsed_chunks:
+                transactions_created += self.import_rows(parsed_rows, account_id, user_id, existing, rules)
+            
+            db.session.commit()
+            return transactions_created
+            
+        except Exception as e:
+            db.session.rollback()
+            raise e
+    
+    def read_chunks(self, filepath: str):
+        """Read the CSV as DataFrames of READ_CHUNK_SIZE rows"""
+        # Every column is cleaned as text anyway, so skip dtype inference and NaN detection
+        return pd.read_csv(filepath, chunksize=READ_CHUNK_SIZE, dtype=str, na_filter=False,
+                           engine='c', **self.read_csv_options)
+    
+    def parse_chunk(self, df: pd.DataFrame) -> List[Tuple]:
+        """Extract (date, description, merchant, amount in cents, type) for the valid rows of one chunk"""
         raise NotImplementedError
     
-    def clean_amount(self, amount_str: str) -> Decimal:
-        """Clean and convert amount string to decimal"""
-        if pd.isna(amount_str) or amount_str == '':
-            return Decimal('0.00')
-        
-        # Convert to string and clean
-        amount_str = str(amount_str).strip()
+    def parse_chunks_in_parallel(self, chunks):
+        """Parse DataFrame chunks in worker processes, yielding the results in file order"""
+        max_workers = os.cpu_count() or 1
+        with _worker_pool(max_workers) as executor:
+            pending = deque()
+            for df in chunks:
+                pending.append(executor.submit(self.parse_chunk, df))
+                # Only keep a couple of chunks per worker in flight so memory stays bounded
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            
+            while pending:
+                yield pending.popleft().result()
+    
+    def parse_to_rows(self, filepath: str) -> List[Tuple]:
+        """Parse a whole file without touching the database, so it can run in a worker process"""
+        rows = []
+        for df in self.read_chunks(filepath):
+            rows.extend(self.parse_chunk(df))
+        return rows
+    
+    def import_rows(self, parsed_rows: List[Tuple], account_id: int, user_id: int,
+                    existing: ExistingTransactionKeys, rules: CategoryRules) -> int:
+        """Insert the parsed rows that aren't duplicates and return how many were created"""
+        if not parsed_rows:
+            return 0
         
-        # Remove currency symbols, spaces, and commas
-        amount_str = re.sub(r'[^\d\.\-\+\(\)]', '', amount_str)
+        # Bound the duplicate-check preload by the dates these rows span
+        dates = [row[0] for row in parsed_rows]
+        existing.cover(min(dates), max(dates))
         
-        # Handle parentheses as negative
-        if '(' in amount_str and ')' in amount_str:
-            amount_str = '-' + amount_str.replace('(', '').replace(')', '')
+        rows = []
+        for transaction_date, description, merchant, amount, transaction_type in parsed_rows:
+            try:
+                # Create transaction
+                transaction = self.create_transaction(
+                    account_id, user_id, transaction_date, description, merchant,
+                    amount, transaction_type, existing, rules
+                )
+                
+                if transaction:
+                    rows.append(transaction)
+            
+            except Exception as e:
+                print(f"Error processing {self.bank_name} row: {e}")
+                continue
         
-        try:
-            return Decimal(amount_str)
-        except:
-            return Decimal('0.00')
+        self.bulk_insert_transactions(rows)
+        return len(rows)
     
-    def parse_date(self, date_str: str, formats: List[str]):
-        """Parse date string using provided formats"""
-        if pd.isna(date_str):
-            return None
-        
-        date_str = str(date_str).strip()
+    def parse_dates(self, dates: pd.Series, formats: List[str]) -> pd.Series:
+        """Parse a column of date strings, trying each format on the rows still unparsed"""
+        dates = dates.astype('string').str.strip()
+        parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
         
         for fmt in formats:
-            try:
-                return datetime.strptime(date_str, fmt).date()
-            except ValueError:
-                continue
+            unparsed = parsed.isna()
+            if not unparsed.any():
+                break
+            parsed[unparsed] = pd.to_datetime(dates[unparsed], format=fmt, errors='coerce')
         
-        return None
+        return parsed
+    
+    def load_existing_transactions(self, account_id: int) -> ExistingTransactionKeys:
+        """Duplicate-check keys for the account, fetched per date span as rows are imported"""
+        return ExistingTransactionKeys(account_id)
     
     def create_transaction(self, account_id: int, user_id: int, date, description: str, 
-                          amount: Decimal, transaction_type: str) -> Optional[Transaction]:
-        """Create a transaction if it doesn't already exist"""
-        # Check for duplicates
-        existing = Transaction.query.join(Account).filter(
-            Account.user_id == user_id,
-            Transaction.account_id == account_id,
-            Transaction.date == date,
-            Transaction.description == description,
-            Transaction.amount == abs(amount)
-        ).first()
-        
-        if existing:
+                          merchant: Optional[str], amount_cents: int, transaction_type: str,
+                          existing: ExistingTransactionKeys, rules: CategoryRules) -> Optional[Dict]:
+        """Build insert parameters for a transaction if it doesn't already exist"""
+        # Check for duplicates against the preloaded keys (and rows seen earlier in this file)
+        amount_cents = abs(amount_cents)
+        key = (date, description, amount_cents)
+        if key in existing:
             return None
+        existing.add(key)
+        
+        return {
+            'account_id': account_id,
+            'date': date,
+            'description': description,
+            # Only rows that are actually inserted pay for a Decimal
+            'amount': Decimal(amount_cents) / 100,
+            'transaction_type': transaction_type,
+            'merchant': merchant,
+            # Auto-categorize against the rules loaded once for this import
+            'category_id': categorize_with_rules(rules, description, merchant),
+        }
+    
+    def bulk_insert_transactions(self, rows: List[Dict]) -> None:
+        """Insert transaction rows in bulk: COPY on PostgreSQL, batched Core INSERTs elsewhere"""
+        if not rows:
+            return
         
-        # Extract merchant name
-        merchant = self.extract_merchant(description)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            self.copy_transactions(rows)
+            return
         
-        # Create transaction
-        transaction = Transaction(
-            account_id=account_id,
-            date=date,
-            description=description,
-            amount=abs(amount),
-            transaction_type=transaction_type,
-            merchant=merchant
-        )
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(Transaction.__table__.insert(), rows[start:start + INSERT_BATCH_SIZE])
+    
+    def copy_transactions(self, rows: List[Dict]) -> None:
+        """Stream transaction rows into PostgreSQL with COPY FROM STDIN, its fastest bulk load path"""
+        # COPY bypasses SQLAlchemy's Python-side column defaults, so supply them here
+        created_at = datetime.utcnow()
         
-        # Auto-categorize
-        category_id = auto_categorize_transaction(description, merchant, user_id)
-        if category_id:
-            transaction.category_id = category_id
+        # None is written as an unquoted empty field, which COPY's CSV format reads as NULL
+        # (descriptions are never empty, so no real value collides with it)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row['account_id'], row['date'], row['description'], row['amount'],
+                             row['transaction_type'], row['merchant'], row['category_id'],
+                             created_at, False])
+        buffer.seek(0)
         
-        return transaction
+        connection = db.session.connection()
+        table = connection.dialect.identifier_preparer.format_table(Transaction.__table__)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table} ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
     
     def extract_merchant(self, description: str) -> Optional[str]:
         """Extract merchant name from description"""
         if not description:
             return None
         
-        # Remove common prefixes and clean up
-        description = re.sub(r'^(POS MERCHANDISE|INTERNET BILL PAYMENT|PAYROLL DEPOSIT|EFT CREDIT|INTERAC E-TRANSFER|ABM WITHDRAWAL)', '', description)
-        description = description.strip()
+        # Remove common prefixes, then take the first part before common separators
+        merchant = _MERCHANT_PREFIX_RE.sub('', description).strip()
+        merchant = _MERCHANT_CUT_RE.sub(_MERCHANT_CUT_REPL, merchant).strip()
         
-        # Take first part before common separators
-        separators = [' - ', ' / ', ' #', ' *', '  ', ',']
-        for sep in separators:
-            if sep in description:
-                description = description.split(sep)[0]
-                break
+        return merchant[:200] if merchant else None
+    
+    def extract_merchants(self, descriptions: pd.Series) -> pd.Series:
+        """Extract merchant names for a whole column of descriptions (None where there is none)"""
+        merchants = descriptions.str.replace(_MERCHANT_PREFIX_RE, '', regex=True).str.strip()
+        merchants = merchants.str.replace(_MERCHANT_CUT_RE, _MERCHANT_CUT_REPL, regex=True).str.strip()
         
-        return description.strip()[:200] if description.strip() else None
+        return merchants.str.slice(0, 200).astype(object).where(merchants.ne('').to_numpy(dtype=bool), None)
 
 
-class AmexParser(CSVParser):
-    """Parser for American Express CSV files"""
-    
-    def __init__(self):
-        super().__init__("American Express")
-    
-    def parse(self, filepath: str, account_id: int, user_id: int) -> int:
-        try:
-            # Read CSV without headers since Amex format doesn't have them
-            df = pd.read_csv(filepath, header=None)
-            
-            # Amex format: Date, Description, Empty, Amount
-            df.columns = ['date', 'description', 'empty', 'amount']
-            
-            transactions_created = 0
-            date_formats = ['%d %b. %Y', '%d %b %Y', '%d %B %Y', '%d %B. %Y']
-            
-            for _, row in df.iterrows():
-                try:
-                    # Parse date
-                    transaction_date = self.parse_date(row['date'], date_formats)
-                    if not transaction_date:
-                        continue
-                    
-                    # Clean description
-                    description = str(row['description']).strip()
-                    if not description or description == 'nan':
-                        continue
-                    
-                    # Parse amount
-                    amount = self.clean_amount(row['amount'])
-                    if amount == 0:
-                        continue
-                    
-                    # Determine transaction type (Amex shows expenses as positive, payments as negative)
-                    transaction_type = 'expense' if amount > 0 else 'income'
-                    
-                    # Create transaction
-                    transaction = self.create_transaction(
-                        account_id, user_id, transaction_date, description, amount, transaction_type
-                    )
-                    
-                    if transaction:
-                        db.session.add(transaction)
-                        transactions_created += 1
-                
-                except Exception as e:
-                    print(f"Error processing Amex row: {e}")
-                    continue
-            
-            db.session.commit()
-            return transactions_created
-            
-        except Exception as e:
-            db.session.rollback()
-            raise e
+@dataclass(frozen=True)
+class BankSpec:
+    """Column layout of one bank's CSV export"""
+    name: str
+    date_col: Union[int, str]
+    desc_col: Union[int, str]
+    # Returns (amount in cents, transaction type) per row; rows with a zero amount are skipped
+    amount_fn: Callable[[pd.DataFrame], Tuple[np.ndarray, np.ndarray]]
+    date_formats: Tuple[str, ...]
+    # Extra keyword arguments for pd.read_csv (header=None for headerless exports, usecols)
+    read_csv_options: Dict = field(default_factory=dict)
+    # Descriptions that mark repeated header lines rather than transactions
+    skip_descriptions: Tuple[str, ...] = ()
 
 
-class CibcParser(CSVParser):
-    """Parser for CIBC CSV files"""
+class TableDrivenParser(CSVParser):
+    """Parser for any bank export described by a BankSpec"""
     
-    def __init__(self):
-        super().__init__("CIBC")
+    def __init__(self, spec: BankSpec):
+        super().__init__(spec.name)
+        self.spec = spec
+        self.read_csv_options = spec.read_csv_options
     
-    def parse(self, filepath: str, account_id: int, user_id: int) -> int:
-        try:
-            df = pd.read_csv(filepath)
-            
-            transactions_created = 0
-            date_formats = ['%Y-%m-%d']
-            
-            for _, row in df.iterrows():
-                try:
-                    # Parse date (first column)
-                    transaction_date = self.parse_date(str(row.iloc[0]), date_formats)
-                    if not transaction_date:
-                        continue
-                    
-                    # Description (second column)
-                    description = str(row.iloc[1]).strip()
-                    if not description or description == 'nan':
-                        continue
-                    
-                    # CIBC has debit and credit columns (columns 2 and 3)
-                    debit = self.clean_amount(str(row.iloc[2]) if len(row) > 2 else '')
-                    credit = self.clean_amount(str(row.iloc[3]) if len(row) > 3 else '')
-                    
-                    # Determine amount and type
-                    if debit > 0:
-                        amount = debit
-                        transaction_type = 'expense'
-                    elif credit > 0:
-                        amount = credit
-                        transaction_type = 'income'
-                    else:
-                        continue
-                    
-                    # Create transaction
-                    transaction = self.create_transaction(
-                        account_id, user_id, transaction_date, description, amount, transaction_type
-                    )
-                    
-                    if transaction:
-                        db.session.add(transaction)
-                        transactions_created += 1
-                
-                except Exception as e:
-                    print(f"Error processing CIBC row: {e}")
-                    continue
-            
-            db.session.commit()
-            return transactions_created
-            
-        except Exception as e:
-            db.session.rollback()
-            raise e
+    def parse_chunk(self, df: pd.DataFrame) -> List[Tuple]:
+        spec = self.spec
+        
+        # Some banks pad their header names with spaces (Simplii's " Transaction Details")
+        if spec.read_csv_options.get('header', 'infer') is not None:
+            df.columns = df.columns.str.strip()
+        
+        # Parse whole columns at once
+        dates = self.parse_dates(_column(df, spec.date_col), list(spec.date_formats))
+        # pandas' string dtype strips the whole column in one vectorized pass
+        descriptions = _column(df, spec.desc_col).astype('string').str.strip()
+        amounts, types = spec.amount_fn(df)
+        
+        valid = (dates.notna() & descriptions.ne('') & descriptions.ne('nan') &
+                 ~descriptions.isin(spec.skip_descriptions) & (amounts != 0)).to_numpy(dtype=bool)
+        
+        descriptions = descriptions[valid]
+        return list(zip(dates[valid].dt.date, descriptions, self.extract_merchants(descriptions),
+                        amounts[valid].tolist(), types[valid].tolist()))
 
 
-class EqBankParser(CSVParser):
-    """Parser for EQ Bank CSV files"""
-    
-    def __init__(self):
-        super().__init__("EQ Bank")
-    
-    def parse(self, filepath: str, account_id: int, user_id: int) -> int:
-        try:
-            df = pd.read_csv(filepath, header=None)
-            
-            # EQ Bank format: Date, Description, Amount, Balance
-            df.columns = ['date', 'description', 'amount', 'balance']
-            
-            transactions_created = 0
-            date_formats = ['%d-%b-%y', '%d-%B-%y', '%d-%b-%Y', '%d-%B-%Y']
-            
-            for _, row in df.iterrows():
-                try:
-                    # Parse date
-                    transaction_date = self.parse_date(row['date'], date_formats)
-                    if not transaction_date:
-                        continue
-                    
-                    # Description
-                    description = str(row['description']).strip()
-                    if not description or description == 'nan':
-                        continue
-                    
-                    # Parse amount - EQ Bank uses ($xxx) for debits
-                    amount_str = str(row['amount']).strip()
-                    amount = self.clean_amount(amount_str)
-                    
-                    if amount == 0:
-                        continue
-                    
-                    # Determine transaction type
-                    transaction_type = 'expense' if amount < 0 else 'income'
-                    
-                    # Create transaction
-                    transaction = self.create_transaction(
-                        account_id, user_id, transaction_date, description, abs(amount), transaction_type
-                    )
-                    
-                    if transaction:
-                        db.session.add(transaction)
-                        transactions_created += 1
-                
-                except Exception as e:
-                    print(f"Error processing EQ Bank row: {e}")
-                    continue
-            
-            db.session.commit()
-            return transactions_created
-            
-        except Exception as e:
-            db.session.rollback()
-            raise e
+def _column(df: pd.DataFrame, col: Union[int, str]) -> pd.Series:
+    """Look a column up by position among the columns read, or by header name"""
+    return df.iloc[:, col] if isinstance(col, int) else df[col]
 
 
-class SimpliiParser(CSVParser):
-    """Parser for Simplii Financial CSV files"""
-    
-    def __init__(self):
-        super().__init__("Simplii Financial")
-    
-    def parse(self, filepath: str, account_id: int, user_id: int) -> int:
-        try:
-            df = pd.read_csv(filepath)
-            
-            transactions_created = 0
-            date_formats = ['%m/%d/%Y', '%d/%m/%Y']
-            
-            for _, row in df.iterrows():
-                try:
-                    # Parse date
-                    transaction_date = self.parse_date(str(row['Date']).strip(), date_formats)
-                    if not transaction_date:
-                        continue
-                    
-                    # Description
-                    description = str(row['Transaction Details']).strip()
-                    if not description or description == 'nan' or description == 'Transaction Details':
-                        continue
-                    
-                    # Simplii has separate Funds Out and Funds In columns
-                    funds_out = self.clean_amount(str(row['Funds Out']) if 'Funds Out' in row else '')
-                    funds_in = self.clean_amount(str(row['Funds In']) if 'Funds In' in row else '')
-                    
-                    # Determine amount and type
-                    if funds_out > 0:
-                        amount = funds_out
-                        transaction_type = 'expense'
-                    elif funds_in > 0:
-                        amount = funds_in
-                        transaction_type = 'income'
-                    else:
-                        continue
-                    
-                    # Create transaction
-                    transaction = self.create_transaction(
-                        account_id, user_id, transaction_date, description, amount, transaction_type
-                    )
-                    
-                    if transaction:
-                        db.session.add(transaction)
-                        transactions_created += 1
-                
-                except Exception as e:
-                    print(f"Error processing Simplii row: {e}")
-                    continue
-            
-            db.session.commit()
-            return transactions_created
-            
-        except Exception as e:
-            db.session.rollback()
-            raise e
+def _optional_amounts(df: pd.DataFrame, col: Union[int, str]) -> np.ndarray:
+    """Cents for a column some exports leave out entirely (zeros when missing)"""
+    present = col < df.shape[1] if isinstance(col, int) else col in df.columns
+    return clean_amounts(_column(df, col)) if present else np.zeros(len(df), dtype=np.int64)
 
 
-class TdParser(CSVParser):
-    """Parser for TD Bank CSV files"""
-    
-    def __init__(self):
-        super().__init__("TD Bank")
-    
-    def parse(self, filepath: str, account_id: int, user_id: int) -> int:
-        try:
-            df = pd.read_csv(filepath)
-            
-            transactions_created = 0
-            date_formats = ['%m/%d/%Y', '%Y-%m-%d', '%d/%m/%Y']
-            
-            for _, row in df.iterrows():
-                try:
-                    # Parse date
-                    transaction_date = self.parse_date(str(row['date']), date_formats)
-                    if not transaction_date:
-                        continue
-                    
-                    # Description
-                    description = str(row['description']).strip()
-                    if not description or description == 'nan':
-                        continue
-                    
-                    # Parse amount (TD shows as debit)
-                    amount = self.clean_amount(str(row['debit']))
-                    if amount == 0:
-                        continue
-                    
-                    # TD format typically shows expenses as positive debits
-                    transaction_type = 'expense'
-                    
-                    # Create transaction
-                    transaction = self.create_transaction(
-                        account_id, user_id, transaction_date, description, amount, transaction_type
-                    )
-                    
-                    if transaction:
-                        db.session.add(transaction)
-                        transactions_created += 1
-                
-                except Exception as e:
-                    print(f"Error processing TD row: {e}")
-                    continue
-            
-            db.session.commit()
-            return transactions_created
-            
-        except Exception as e:
-            db.session.rollback()
-            raise e
+def _debit_credit_amounts(debits: np.ndarray, credits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Amount and type for exports with separate debit and credit columns"""
+    amounts = np.where(debits > 0, debits, np.where(credits > 0, credits, 0))
+    types = np.where(debits > 0, 'expense', 'income')
+    return amounts, types
 
 
-def get_parser_by_format(format_type: str) -> CSVParser:
-    """Factory function to get the appropriate parser"""
-    parsers = {
-        'amex': AmexParser(),
-        'cibc': CibcParser(),
-        'eq_bank': EqBankParser(),
-        'simplii': SimpliiParser(),
-        'td': TdParser(),
-        'generic': None  # Will use the original generic parser
-    }
-    
-    return parsers.get(format_type)
+def _signed_amounts(amounts: np.ndarray, expenses_positive: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Amount and type for exports with a single signed amount column"""
+    is_expense = amounts > 0 if expenses_positive else amounts < 0
+    return np.abs(amounts), np.where(is_expense, 'expense', 'income')
+
+
+def _amex_amounts(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # Amex shows expenses as positive, payments as negative
+    return _signed_amounts(clean_amounts(df.iloc[:, 2]), expenses_positive=True)
+
+
+def _cibc_amounts(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # CIBC has debit and credit columns (columns 2 and 3)
+    return _debit_credit_amounts(_optional_amounts(df, 2), _optional_amounts(df, 3))
+
+
+def _eq_bank_amounts(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # EQ Bank uses ($xxx) for debits
+    return _signed_amounts(clean_amounts(df.iloc[:, 2]), expenses_positive=False)
+
+
+def _simplii_usecols(name: str) -> bool:
+    # Simplii pads its header names with spaces, so match them stripped
+    return name.strip() in ('Date', 'Transaction Details', 'Funds Out', 'Funds In')
+
+
+def _simplii_amounts(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # Simplii has separate Funds Out and Funds In columns
+    return _debit_credit_amounts(_optional_amounts(df, 'Funds Out'), _optional_amounts(df, 'Funds In'))
+
+
+def _td_amounts(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # TD format typically shows expenses as positive debits
+    amounts = clean_amounts(df['debit'])
+    return amounts, np.full(len(amounts), 'expense')
+
 
+# Amex format: Date, Description, Empty, Amount
+AMEX_SPEC = BankSpec('American Express', 0, 1, _amex_amounts,
+                     ('%d %b. %Y', '%d %b %Y', '%d %B %Y', '%d %B. %Y'),
+                     read_csv_options={'header': None, 'usecols': [0, 1, 3]})
 
-def detect_csv_format(filepath: str) -> str:
-    """Automatically detect CSV format based on file content"""
+CIBC_SPEC = BankSpec('CIBC', 0, 1, _cibc_amounts, ('%Y-%m-%d',))
+
+# EQ Bank format: Date, Description, Amount, Balance
+EQ_BANK_SPEC = BankSpec('EQ Bank', 0, 1, _eq_bank_amounts,
+                        ('%d-%b-%y', '%d-%B-%y', '%d-%b-%Y', '%d-%B-%Y'),
+                        read_csv_options={'header': None, 'usecols': [0, 1, 2]})
+
+SIMPLII_SPEC = BankSpec('Simplii Financial', 'Date', 'Transaction Details', _simplii_amounts,
+                        ('%m/%d/%Y', '%d/%m/%Y'),
+                        read_csv_options={'usecols': _simplii_usecols},
+                        skip_descriptions=('Transaction Details',))
+
+TD_SPEC = BankSpec('TD Bank', 'date', 'description', _td_amounts,
+                   ('%m/%d/%Y', '%Y-%m-%d', '%d/%m/%Y'),
+                   read_csv_options={'usecols': ['date', 'description', 'debit']})
+
+BANK_SPECS = {
+    'amex': AMEX_SPEC,
+    'cibc': CIBC_SPEC,
+    'eq_bank': EQ_BANK_SPEC,
+    'simplii': SIMPLII_SPEC,
+    'td': TD_SPEC,
+}
+
+
+def get_parser_by_format(format_type: str) -> Optional[CSVParser]:
+    """Factory function to get the appropriate parser ('generic' has none)"""
+    spec = BANK_SPECS.get(format_type)
+    return TableDrivenParser(spec) if spec else None
+
+
+def _parse_file_in_worker(format_type: str, filepath: str) -> List[Tuple]:
+    """Worker process entry point: parse one file into rows (no database access)"""
+    return get_parser_by_format(format_type).parse_to_rows(filepath)
+
+
+def _worker_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Process pool for CPU-bound parsing
+
+    Workers are spawned, not forked: the server runs threads (the import executor, the
+    login attempt writer) and a fork could copy their locks while held. A fresh interpreter
+    must import app before this module, so that is the workers' initializer.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=importlib.import_module,
+                               initargs=('app',))
+
+
+def parse_files(files: List[Tuple[str, str]], account_id: int, user_id: int) -> int:
+    """Import several (format, filepath) CSVs into one account, parsing the files in parallel"""
+    try:
+        transactions_created = 0
+        formats, paths = zip(*files)
+        parsers = [get_parser_by_format(format_type) for format_type in formats]
+        existing = parsers[0].load_existing_transactions(account_id)
+        rules = load_category_rules(user_id)
+        
+        # Parsing is CPU bound, so large uploads are spread across processes; the workers
+        # never touch the database and duplicate checks/inserts stay in this process
+        max_workers = min(len(files), os.cpu_count() or 1)
+        if max_workers > 1 and sum(os.path.getsize(path) for path in paths) >= PARALLEL_PARSE_BYTES:
+            with _worker_pool(max_workers) as executor:
+                parsed_files = list(executor.map(_parse_file_in_worker, formats, paths))
+        else:
+            parsed_files = [parser.parse_to_rows(path) for parser, path in zip(parsers, paths)]
+        
+        for parser, parsed_rows in zip(parsers, parsed_files):
+            transactions_created += parser.import_rows(parsed_rows, account_id, user_id, existing, rules)
+        
+        db.session.commit()
+        return transactions_created
+        
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def detect_csv_format(source: Union[str, BinaryIO]) -> str:
+    """Automatically detect CSV format based on file content (a path or a binary file object)"""
     try:
-        # Read first few lines to detect format
-        with open(filepath, 'r') as f:
-            first_line = f.readline().strip()
-            second_line = f.readline().strip()
+        # Read the head of the file in one go; only the first two lines are inspected
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                head = f.read(FORMAT_SNIFF_BYTES)
+        else:
+            # e.g. an upload stream; rewind it so it can still be saved in full
+            head = source.read(FORMAT_SNIFF_BYTES)
+            source.seek(0)
+        head = head.decode('utf-8', errors='ignore')
+        
+        lines = head.splitlines()
+        first_line = lines[0].strip() if lines else ''
+        second_line = lines[1].strip() if len(lines) > 1 else ''
+        first_lower = first_line.lower()
         
         # Amex format detection (no header, starts with date)
-        if not first_line.lower().startswith(('date', 'transaction')) and re.match(r'\d+\s+(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)', first_line):
+        if not first_lower.startswith(('date', 'transaction')) and _AMEX_DATE_RE.match(first_line):
             return 'amex'
         
         # CIBC format detection (has header, specific format)
-        if 'cibc' in first_line.lower() or ('mastercard' in first_line.lower() and 'payment thank you' in second_line.lower()):
+        if 'cibc' in first_lower or ('mastercard' in first_lower and 'payment thank you' in second_line.lower()):
             return 'cibc'
         
         # EQ Bank format detection
-        if re.match(r'\d+-\w+-\d+', first_line) and ('deposit' in first_line.lower() or 'transfer' in first_line.lower()):
+        if _EQ_BANK_DATE_RE.match(first_line) and ('deposit' in first_lower or 'transfer' in first_lower):
             return 'eq_bank'
         
         # Simplii format detection
-        if 'transaction details' in first_line.lower() and 'funds out' in first_line.lower():
+        if 'transaction details' in first_lower and 'funds out' in first_lower:
             return 'simplii'
         
         # TD format detection
-        if 'date,description,debit' in first_line.lower():
+        if 'date,description,debit' in first_lower:
             return 'td'
         
         return 'generic'
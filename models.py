@@ -1,12 +1,56 @@
 from datetime import datetime, timedelta
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import pyotp
 import qrcode
 import io
 import base64
-import time
+import hmac
+from functools import lru_cache
+
+
+# Argon2id runs in a single C call; werkzeug hashes are still accepted for existing users
+_password_hasher = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=1)
+
+# Backup codes are short, so they get salted argon2id hashes too, with the OWASP minimum
+# parameters: verifying checks each of a user's unused codes, about 30ms apiece
+_backup_code_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# TOTP accepts ±5 time steps (±2.5 minutes) around the current one
+TOTP_VALID_WINDOW = 5
+
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash():
+    """Argon2 hash with the current parameters, verified against when no user matches"""
+    return _password_hasher.hash('budgetbuddy-dummy-password')
+
+
+def check_dummy_password(password):
+    """Spend as long as a real password check and fail, so unknown usernames can't be told apart by timing"""
+    try:
+        _password_hasher.verify(_dummy_password_hash(), password or '')
+    except (VerificationError, InvalidHashError):
+        pass
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _qr_code_png_base64(uri):
+    """Render a provisioning URI as a base64-encoded PNG QR code"""
+    qr = qrcode.main.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(uri)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    buffer.seek(0)
+    
+    return base64.b64encode(buffer.getvalue()).decode()
 
 
 class User(UserMixin, db.Model):
@@ -19,7 +63,8 @@ class User(UserMixin, db.Model):
     # Two-Factor Authentication fields
     totp_secret = db.Column(db.String(32), nullable=True)
     is_two_factor_enabled = db.Column(db.Boolean, default=False)
-    two_factor_backup_codes = db.Column(db.Text, nullable=True)  # JSON string of backup codes
+    last_totp_step = db.Column(db.Integer, nullable=True)  # Time step of the last accepted TOTP code
+    two_factor_backup_codes = db.Column(db.Text, nullable=True)  # Legacy JSON list, kept only for move_legacy_backup_codes
     
     # Security fields
     failed_login_attempts = db.Column(db.Integer, default=0)
@@ -32,13 +77,32 @@ class User(UserMixin, db.Model):
     accounts = db.relationship('Account', backref='user', lazy=True, cascade='all, delete-orphan')
     budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan')
     categories = db.relationship('Category', backref='user', lazy=True, cascade='all, delete-orphan')
+    backup_codes = db.relationship('BackupCode', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _password_hasher.hash(password)
         self.password_changed_at = datetime.utcnow()
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not self.password_hash or password is None:
+            return False
+        
+        # Hashes from before the switch to Argon2 are upgraded on the next successful check
+        if not self.password_hash.startswith('$argon2'):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.password_hash = _password_hasher.hash(password)
+            return True
+        
+        try:
+            _password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        
+        # Re-hash if the cost parameters have been raised since this hash was made
+        if _password_hasher.check_needs_rehash(self.password_hash):
+            self.password_hash = _password_hasher.hash(password)
+        return True
     
     def is_account_locked(self):
         """Check if account is currently locked due to failed login attempts"""
@@ -87,45 +151,61 @@ class User(UserMixin, db.Model):
             return False
             
         try:
-            # Create TOTP object
             totp = pyotp.TOTP(self.totp_secret)
-            
-            # Try exact match first
-            if totp.verify(token):
-                return True
-                
-            # If that fails, try with a larger window (±5 windows = ±2.5 minutes)
-            return totp.verify(token, valid_window=5)
+            current_step = totp.timecode(datetime.now())
+            # Steps up to the last accepted one are already used, so only later ones are generated
+            last_step = self.last_totp_step if self.last_totp_step is not None else -1
+            first_step = max(current_step - TOTP_VALID_WINDOW, last_step + 1)
+            matched_step = next((step for step in range(first_step, current_step + TOTP_VALID_WINDOW + 1)
+                                 if hmac.compare_digest(token.encode(), totp.generate_otp(step).encode())), None)
         except Exception:
             # Catch any unexpected errors in the TOTP library
             return False
+        
+        if matched_step is None:
+            return False
+        
+        # Claim the step in the database so a code is accepted once across all workers; a concurrent
+        # request that already claimed it (or a later one) leaves no row to update. Committed here
+        # so the claim never depends on the caller.
+        claimed = db.session.execute(
+            db.update(User).where(
+                User.id == self.id,
+                db.or_(User.last_totp_step.is_(None), User.last_totp_step < matched_step)
+            ).values(last_totp_step=matched_step)
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
     
     def generate_backup_codes(self):
-        """Generate backup codes for 2FA recovery"""
+        """Generate backup codes for 2FA recovery (only their hashes are stored)"""
         import secrets
-        import json
-        codes = [secrets.token_hex(4).upper() for _ in range(10)]
-        self.two_factor_backup_codes = json.dumps(codes)
+        codes = []
+        while len(codes) < 10:
+            code = secrets.token_hex(4).upper()
+            if code not in codes:
+                codes.append(code)
+        
+        # Replace any previous codes
+        BackupCode.query.filter_by(user_id=self.id).delete()
+        db.session.add_all(BackupCode(user_id=self.id, code_hash=BackupCode.hash_code(code)) for code in codes)
         return codes
     
     def verify_backup_code(self, code):
         """Verify and consume a backup code"""
-        if not self.two_factor_backup_codes:
-            return False
-        
         # Normalize the code (remove spaces, convert to uppercase)
         code = ''.join(c for c in code if c.isalnum()).upper()
         
-        import json
-        try:
-            codes = json.loads(self.two_factor_backup_codes)
-            if code in codes:
-                codes.remove(code)
-                self.two_factor_backup_codes = json.dumps(codes)
+        # Hashes are salted, so each unused code is checked in turn
+        for backup_code in BackupCode.query.filter_by(user_id=self.id, used=False).all():
+            if backup_code.matches(code):
+                # Only one of two requests racing with the same code finds it still unused
+                consumed = db.session.execute(
+                    db.update(BackupCode).where(BackupCode.id == backup_code.id, BackupCode.used.is_(False))
+                    .values(used=True)
+                ).rowcount
                 db.session.commit()
-                return True
-        except (json.JSONDecodeError, ValueError):
-            pass
+                return consumed == 1
         return False
     
     def enable_two_factor(self):
@@ -140,7 +220,7 @@ class User(UserMixin, db.Model):
         """Disable two-factor authentication"""
         self.is_two_factor_enabled = False
         self.totp_secret = None
-        self.two_factor_backup_codes = None
+        BackupCode.query.filter_by(user_id=self.id).delete()
         db.session.commit()
     
     def generate_qr_code(self, app_name="BudgetBuddy"):
@@ -152,16 +232,34 @@ class User(UserMixin, db.Model):
         if not uri:
             return None
         
-        qr = qrcode.main.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(uri)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        return base64.b64encode(buffer.getvalue()).decode()
+        # The image only changes when the secret does, so it is cached by URI
+        return _qr_code_png_base64(uri)
+
+
+class BackupCode(db.Model):
+    """Single-use 2FA recovery code, stored as a salted argon2id hash"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    code_hash = db.Column(db.String(128), nullable=False)
+    used = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Verification loads a user's unused codes
+        db.Index('ix_backup_code_user', 'user_id'),
+    )
+    
+    @staticmethod
+    def hash_code(code):
+        """Hash a normalized backup code for storage"""
+        return _backup_code_hasher.hash(code)
+    
+    def matches(self, code):
+        """Whether a normalized backup code is this one"""
+        try:
+            return _backup_code_hasher.verify(self.code_hash, code)
+        except (VerificationError, InvalidHashError):
+            return False
 
 
 class Account(db.Model):
@@ -175,6 +273,11 @@ class Account(db.Model):
     
     # Relationships
     transactions = db.relationship('Transaction', backref='account', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Every page lists or checks the user's accounts, ordered by name
+        db.Index('ix_account_user_name', 'user_id', 'name'),
+    )
 
 
 class Category(db.Model):
@@ -191,6 +294,11 @@ class Category(db.Model):
     # Relationships
     transactions = db.relationship('Transaction', backref='category', lazy=True)
     budget_items = db.relationship('BudgetItem', backref='category', lazy=True)
+    
+    __table_args__ = (
+        # One category per name for each user; new categories insert with ON CONFLICT against it
+        db.Index('ix_category_user_name', 'user_id', 'name', unique=True),
+    )
 
 
 class Transaction(db.Model):
@@ -204,11 +312,24 @@ class Transaction(db.Model):
     merchant = db.Column(db.String(200))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)  # Last change after import; NULL until then
     is_split = db.Column(db.Boolean, default=False)
     parent_transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
     
     # Self-referential relationship for split transactions
     split_transactions = db.relationship('Transaction', backref=db.backref('parent_transaction', remote_side=[id]), lazy=True)
+    
+    __table_args__ = (
+        # Duplicate detection during CSV import looks rows up by these columns; its
+        # (account_id, date) prefix also serves the per-account date ranges and ordering
+        db.Index('ix_tx_dup', 'account_id', 'date', 'description', 'amount'),
+        # Category filters and per-category totals
+        db.Index('ix_tx_cat_date', 'category_id', 'date'),
+        # Spending charts and totals only look at expenses
+        db.Index('ix_tx_expense_acct_date', 'account_id', 'date',
+                 postgresql_where=db.text("transaction_type = 'expense'"),
+                 sqlite_where=db.text("transaction_type = 'expense'")),
+    )
 
 
 class Budget(db.Model):
@@ -259,3 +380,78 @@ class LoginAttempt(db.Model):
     two_factor_used = db.Column(db.Boolean, default=False)
     
     user = db.relationship('User', backref='login_attempts')
+    
+    __table_args__ = (
+        # The security log reads a user's most recent attempts
+        db.Index('ix_login_attempt_user_created', 'user_id', 'created_at'),
+    )
+
+
+class ImportJob(db.Model):
+    """A CSV upload being imported in the background"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    formats = db.Column(db.String(200))  # Display names of the detected CSV formats
+    transactions_created = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+def merge_duplicate_categories(connection):
+    """Fold categories sharing a user and name into the oldest one, so ix_category_user_name can be created"""
+    category = Category.__table__
+    duplicates = connection.execute(
+        db.select(category.c.user_id, category.c.name, db.func.min(category.c.id))
+        .group_by(category.c.user_id, category.c.name)
+        .having(db.func.count() > 1)
+    ).all()
+    
+    for user_id, name, keep_id in duplicates:
+        merged_ids = connection.execute(
+            db.select(category.c.id).where(
+                category.c.user_id == user_id, category.c.name == name, category.c.id != keep_id
+            )
+        ).scalars().all()
+        
+        # Point everything that referenced a duplicate at the category being kept
+        for column in (Transaction.__table__.c.category_id, BudgetItem.__table__.c.category_id,
+                       CategorizationRule.__table__.c.category_id, category.c.parent_id):
+            connection.execute(
+                db.update(column.table).where(column.in_(merged_ids)).values({column.name: keep_id})
+            )
+        
+        # A duplicate may have been the parent of the category being kept
+        connection.execute(
+            db.update(category).where(category.c.id == keep_id, category.c.parent_id == keep_id)
+            .values(parent_id=None)
+        )
+        connection.execute(db.delete(category).where(category.c.id.in_(merged_ids)))
+
+
+def move_legacy_backup_codes(connection):
+    """Store backup codes still kept in the legacy JSON column as BackupCode hashes and clear the column
+
+    The column is cleared in the same transaction, so codes are never carried over twice.
+    """
+    import json
+    user = User.__table__
+    backup_code = BackupCode.__table__
+    legacy = connection.execute(
+        db.select(user.c.id, user.c.two_factor_backup_codes).where(user.c.two_factor_backup_codes.isnot(None))
+    ).all()
+    
+    for user_id, codes_json in legacy:
+        try:
+            codes = set(json.loads(codes_json))
+        except (ValueError, TypeError, AttributeError):
+            # Unreadable lists never verified any code, so there is nothing to carry over
+            codes = set()
+        
+        if codes:
+            connection.execute(backup_code.insert(), [
+                {'user_id': user_id, 'code_hash': BackupCode.hash_code(code)} for code in codes
+            ])
+        connection.execute(db.update(user).where(user.c.id == user_id).values(two_factor_backup_codes=None))
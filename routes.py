@@ -1,48 +1,175 @@
+import atexit
+import base64
 import os
-import secrets
-from datetime import datetime, date
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
 from decimal import Decimal
-from flask import render_template, request, redirect, url_for, flash, jsonify, session
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, g
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
-from sqlalchemy import func, and_, or_
+from sqlalchemy import Float, case, cast, func, or_, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import aliased, contains_eager, joinedload
 from app import app, db
-from models import User, Account, Category, Transaction, Budget, BudgetItem, CategorizationRule, LoginAttempt
+from models import User, Account, Category, Transaction, Budget, BudgetItem, CategorizationRule, LoginAttempt, ImportJob, check_dummy_password
 
-from csv_parsers import get_parser_by_format, detect_csv_format
-from categorization import auto_categorize_transaction
+from csv_parsers import get_parser_by_format, detect_csv_format, parse_files
 from ai_categorizer import auto_categorize_uncategorized_transactions, get_categorization_suggestions
 
 
+# Login attempts are written in batches by a background thread, off the login request path
+LOGIN_ATTEMPT_BATCH_SIZE = 200
+LOGIN_ATTEMPT_FLUSH_SECONDS = 0.5
+
+_login_attempt_queue = queue.Queue()
+_login_attempt_writer = None
+_login_attempt_writer_lock = threading.Lock()
+# Queued at exit to have the writer flush what it holds and stop
+_STOP_LOGIN_ATTEMPT_WRITER = object()
+
+
 def log_login_attempt(user_id, username, success=False, two_factor_used=False):
     """Log login attempt for security monitoring"""
-    attempt = LoginAttempt(
-        user_id=user_id,
-        ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent'),
-        attempted_username=username,
-        success=success,
-        two_factor_used=two_factor_used
-    )
-    db.session.add(attempt)
-    db.session.commit()
+    _start_login_attempt_writer()
+    _login_attempt_queue.put({
+        'user_id': user_id,
+        'ip_address': request.remote_addr,
+        'user_agent': request.headers.get('User-Agent'),
+        'attempted_username': username,
+        'success': success,
+        'two_factor_used': two_factor_used,
+        # Stamped now rather than when the batch is written
+        'created_at': datetime.utcnow(),
+    })
+
+
+def _start_login_attempt_writer():
+    """Start this process's writer thread on first use (so forked workers each get their own)"""
+    global _login_attempt_writer
+    with _login_attempt_writer_lock:
+        if _login_attempt_writer is None or not _login_attempt_writer.is_alive():
+            _login_attempt_writer = threading.Thread(
+                target=_write_login_attempts, name='login-attempt-writer', daemon=True
+            )
+            _login_attempt_writer.start()
+
+
+def _write_login_attempts():
+    """Drain the login attempt queue, inserting up to a batch at a time"""
+    stopping = False
+    while not stopping:
+        # Wait for an attempt, then gather whatever else arrives within the flush interval
+        batch = [_login_attempt_queue.get()]
+        deadline = time.monotonic() + LOGIN_ATTEMPT_FLUSH_SECONDS
+        while len(batch) < LOGIN_ATTEMPT_BATCH_SIZE and batch[-1] is not _STOP_LOGIN_ATTEMPT_WRITER:
+            try:
+                batch.append(_login_attempt_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        
+        if batch[-1] is _STOP_LOGIN_ATTEMPT_WRITER:
+            batch.pop()
+            stopping = True
+        if not batch:
+            continue
+        
+        try:
+            with app.app_context():
+                db.session.execute(LoginAttempt.__table__.insert(), batch)
+                db.session.commit()
+        except Exception as e:
+            print(f"Error writing login attempts: {e}")
+
+
+@atexit.register
+def _stop_login_attempt_writer():
+    """Flush queued login attempts before the process exits, since the writer is a daemon thread"""
+    with _login_attempt_writer_lock:
+        writer = _login_attempt_writer
+    if writer is not None and writer.is_alive():
+        _login_attempt_queue.put(_STOP_LOGIN_ATTEMPT_WRITER)
+        writer.join(timeout=5)
+
+
+PASSWORD_SPECIAL_CHARACTERS = frozenset("!@#$%^&*()_+-=[]{}|;:,.<>?")
 
 
 def validate_password_strength(password):
     """Validate password meets security requirements"""
     if len(password) < 8:
         return False, "Password must be at least 8 characters long"
-    if not any(c.isupper() for c in password):
+    
+    # Each character class is checked against the distinct characters, collected in one pass
+    characters = set(password)
+    if not any(c.isupper() for c in characters):
         return False, "Password must contain at least one uppercase letter"
-    if not any(c.islower() for c in password):
+    if not any(c.islower() for c in characters):
         return False, "Password must contain at least one lowercase letter"
-    if not any(c.isdigit() for c in password):
+    if not any(c.isdigit() for c in characters):
         return False, "Password must contain at least one number"
-    if not any(c in "!@#$%^&*()_+-=[]{}|;:,.<>?" for c in password):
+    if characters.isdisjoint(PASSWORD_SPECIAL_CHARACTERS):
         return False, "Password must contain at least one special character"
     return True, "Password is valid"
 
 
+def get_user_accounts():
+    """Current user's accounts by name, queried at most once per request"""
+    if 'user_accounts' not in g:
+        g.user_accounts = Account.query.filter_by(user_id=current_user.id).order_by(Account.name).all()
+    return g.user_accounts
+
+
+def get_user_categories():
+    """Current user's categories by name, queried at most once per request"""
+    if 'user_categories' not in g:
+        g.user_categories = Category.query.filter_by(user_id=current_user.id).order_by(Category.name).all()
+    return g.user_categories
+
+
+def owned_by_current_user():
+    """Filter limiting transactions to the current user's accounts, for queries that read no Account columns"""
+    return Transaction.account_id.in_(select(Account.id).where(Account.user_id == current_user.id))
+
+
+def get_category_spending(start_date):
+    """Current user's expense totals per category since start_date, as (name, total, color) rows by name
+
+    The outer join puts uncategorized spending in a group of its own (no name), sorted last.
+    """
+    return db.session.query(
+        Category.name,
+        func.sum(Transaction.amount).label('total'),
+        Category.color
+    ).select_from(Transaction).join(Account).outerjoin(Category).filter(
+        Account.user_id == current_user.id,
+        Transaction.date >= start_date,
+        Transaction.transaction_type == 'expense'
+    ).group_by(Category.id).order_by(Category.id.is_(None), Category.name).all()
+
+
+def get_spending_etag(start_date):
+    """ETag for the spending chart since start_date, built without running the aggregation
+
+    Imports raise the count and the highest id, deletions lower the count and
+    recategorizing bumps updated_at, so any change to the chart changes the tag.
+    """
+    count, last_id, last_update = db.session.query(
+        func.count(Transaction.id),
+        func.max(Transaction.id),
+        func.max(Transaction.updated_at)
+    ).join(Account).filter(
+        Account.user_id == current_user.id,
+        Transaction.date >= start_date,
+        Transaction.transaction_type == 'expense'
+    ).one()
+    last_update = last_update.isoformat() if last_update else ''
+    return f'{start_date.isoformat()}-{count}-{last_id or 0}-{last_update}'
+
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
@@ -69,12 +196,16 @@ def register():
             flash(message, 'error')
             return render_template('register.html')
         
-        # Check if user already exists
-        if User.query.filter_by(username=username).first():
+        # Check if user already exists; one lookup covers both the username and the email
+        taken = db.session.query(User.username, User.email).filter(
+            or_(User.username == username, User.email == email)
+        ).all()
+        
+        if any(row.username == username for row in taken):
             flash('Username already exists', 'error')
             return render_template('register.html')
         
-        if User.query.filter_by(email=email).first():
+        if taken:
             flash('Email already exists', 'error')
             return render_template('register.html')
         
@@ -84,7 +215,14 @@ def register():
         user.email = email
         user.set_password(password)
         db.session.add(user)
-        db.session.commit()
+        
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered the same username or email since the check above
+            db.session.rollback()
+            flash('Username or email already exists', 'error')
+            return render_template('register.html')
         
         # Create default categories
         create_default_categories(user.id)
@@ -154,7 +292,8 @@ def login():
                 log_login_attempt(user.id, username, success=False)
                 flash('Invalid username or password', 'error')
         else:
-            # User not found
+            # User not found; still pay for a hash check so the response takes as long as a wrong password
+            check_dummy_password(password)
             log_login_attempt(None, username, success=False)
             flash('Invalid username or password', 'error')
     
@@ -294,25 +433,25 @@ def security_log():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get summary data
-    total_balance = db.session.query(func.sum(Account.balance)).filter_by(user_id=current_user.id).scalar() or 0
-    total_accounts = Account.query.filter_by(user_id=current_user.id, is_active=True).count()
-    
-    # Get recent transactions
-    recent_transactions = Transaction.query.join(Account).filter(
-        Account.user_id == current_user.id
-    ).order_by(Transaction.date.desc()).limit(10).all()
+    # Get summary data in one pass over the user's accounts
+    total_balance, total_accounts = db.session.query(
+        func.sum(Account.balance),
+        func.count(case((Account.is_active, 1)))
+    ).filter(Account.user_id == current_user.id).one()
+    total_balance = total_balance or 0
+    
+    # Get recent transactions, just the columns the widget shows
+    recent_transactions = db.session.query(
+        Transaction.date,
+        Transaction.description,
+        Transaction.amount,
+        Transaction.transaction_type
+    ).filter(owned_by_current_user())\
+        .order_by(Transaction.date.desc(), Transaction.id.desc()).limit(10).all()
     
     # Get spending by category for current month
     current_month = date.today().replace(day=1)
-    spending_by_category = db.session.query(
-        Category.name,
-        func.sum(Transaction.amount).label('total')
-    ).join(Transaction).join(Account).filter(
-        Account.user_id == current_user.id,
-        Transaction.date >= current_month,
-        Transaction.transaction_type == 'expense'
-    ).group_by(Category.name).all()
+    spending_by_category = [row for row in get_category_spending(current_month) if row.name is not None]
     
     return render_template('dashboard.html', 
                          total_balance=total_balance,
@@ -324,7 +463,15 @@ def dashboard():
 @app.route('/accounts')
 @login_required
 def accounts():
-    user_accounts = Account.query.filter_by(user_id=current_user.id).all()
+    # Plain rows with just the columns the page shows
+    user_accounts = db.session.query(
+        Account.id,
+        Account.name,
+        Account.account_type,
+        Account.balance,
+        Account.is_active,
+        Account.created_at
+    ).filter(Account.user_id == current_user.id).all()
     return render_template('accounts.html', accounts=user_accounts)
 
 
@@ -404,12 +551,14 @@ def delete_account():
         flash('Account not found', 'error')
         return redirect(url_for('accounts'))
     
-    # Check if account has transactions
-    transaction_count = Transaction.query.filter_by(account_id=account.id).count()
     account_name = account.name
     
     try:
-        # Delete the account (this will cascade delete all associated transactions)
+        # Delete the transactions in one statement rather than loading each for the ORM cascade;
+        # the deleted row count is the number reported back
+        transaction_count = Transaction.query.filter_by(account_id=account.id).delete(synchronize_session=False)
+        # Import history references the account too
+        ImportJob.query.filter_by(account_id=account.id).delete(synchronize_session=False)
         db.session.delete(account)
         db.session.commit()
         
@@ -424,10 +573,30 @@ def delete_account():
     return redirect(url_for('accounts'))
 
 
+TRANSACTIONS_PER_PAGE = 50
+
+
+def encode_page_cursor(transaction):
+    """Opaque cursor for a transaction's (date, id) position in the transaction history"""
+    return base64.urlsafe_b64encode(f"{transaction.date.isoformat()}|{transaction.id}".encode()).decode()
+
+
+def decode_page_cursor(cursor):
+    """(date, id) position from a page cursor, or None if missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        day, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return date.fromisoformat(day), int(transaction_id)
+    except ValueError:
+        return None
+
+
 @app.route('/transactions')
 @login_required
 def transactions():
-    page = request.args.get('page', 1, type=int)
+    after = decode_page_cursor(request.args.get('after'))
+    before = decode_page_cursor(request.args.get('before'))
     category_filter = request.args.get('category')
     account_filter = request.args.get('account')
     date_from = request.args.get('date_from')
@@ -443,23 +612,44 @@ def transactions():
         query = query.filter(Transaction.account_id == account_filter)
     
     if date_from:
-        query = query.filter(Transaction.date >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        query = query.filter(Transaction.date >= date.fromisoformat(date_from))
     
     if date_to:
-        query = query.filter(Transaction.date <= datetime.strptime(date_to, '%Y-%m-%d').date())
-    
-    transactions_data = query.order_by(Transaction.date.desc()).paginate(
-        page=page, per_page=50, error_out=False
-    )
+        query = query.filter(Transaction.date <= date.fromisoformat(date_to))
+    
+    # Each row's account comes from the join above and its category from a LEFT JOIN,
+    # rather than two lazy loads per row while the template renders
+    query = query.options(contains_eager(Transaction.account), joinedload(Transaction.category))
+    
+    # Keyset pagination: pages continue from a (date, id) cursor instead of an OFFSET,
+    # and one extra row tells whether there is another page, so no COUNT is needed
+    position = tuple_(Transaction.date, Transaction.id)
+    if before:
+        # Newer page: read forward from the cursor, then put it back in newest-first order
+        rows = query.filter(position > before).order_by(Transaction.date, Transaction.id)\
+            .limit(TRANSACTIONS_PER_PAGE + 1).all()
+        has_newer = len(rows) > TRANSACTIONS_PER_PAGE
+        transactions_data = rows[:TRANSACTIONS_PER_PAGE][::-1]
+        has_older = True
+    else:
+        if after:
+            query = query.filter(position < after)
+        rows = query.order_by(Transaction.date.desc(), Transaction.id.desc())\
+            .limit(TRANSACTIONS_PER_PAGE + 1).all()
+        has_older = len(rows) > TRANSACTIONS_PER_PAGE
+        transactions_data = rows[:TRANSACTIONS_PER_PAGE]
+        has_newer = after is not None
     
-    # Get filter options
-    categories = Category.query.filter_by(user_id=current_user.id).all()
-    accounts = Account.query.filter_by(user_id=current_user.id).all()
+    # Pagination links keep the current filters
+    filter_args = {key: value for key, value in request.args.items() if key not in ('after', 'before', 'page')}
     
     return render_template('transactions.html',
                          transactions=transactions_data,
-                         categories=categories,
-                         accounts=accounts)
+                         newer_cursor=encode_page_cursor(transactions_data[0]) if has_newer and transactions_data else None,
+                         older_cursor=encode_page_cursor(transactions_data[-1]) if has_older and transactions_data else None,
+                         filter_args=filter_args,
+                         categories=get_user_categories(),
+                         accounts=get_user_accounts())
 
 
 @app.route('/upload', methods=['GET', 'POST'])
@@ -470,12 +660,12 @@ def upload():
             flash('No file selected', 'error')
             return redirect(request.url)
         
-        file = request.files['file']
+        files = request.files.getlist('file')
         account_id = request.form.get('account_id')
         create_new_account = request.form.get('create_new_account')
         csv_format = request.form.get('csv_format', 'auto')
         
-        if file.filename == '':
+        if not files or any(file.filename == '' for file in files):
             flash('No file selected', 'error')
             return redirect(request.url)
         
@@ -504,42 +694,144 @@ def upload():
             flash('Please select an account or create a new one', 'error')
             return redirect(request.url)
         
-        if file and file.filename.lower().endswith('.csv'):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
+        if all(file.filename.lower().endswith('.csv') for file in files):
             try:
-                # Determine CSV format
+                # Determine CSV format of each file from the upload itself, before anything is written to disk
                 if csv_format == 'auto':
-                    detected_format = detect_csv_format(filepath)
-                    csv_format = detected_format
-                
-                # Use appropriate parser
-                parser = get_parser_by_format(csv_format)
-                if parser:
-                    transactions_count = parser.parse(filepath, int(account_id), current_user.id)
+                    formats = [detect_csv_format(file.stream) for file in files]
                 else:
-                    raise ValueError(f"Unsupported CSV format: {csv_format}")
+                    formats = [csv_format] * len(files)
+                
+                unsupported = [fmt for fmt in formats if not get_parser_by_format(fmt)]
+                if unsupported:
+                    raise ValueError(f"Unsupported CSV format: {unsupported[0]}")
                 
-                flash(f'Successfully imported {transactions_count} transactions using {csv_format.replace("_", " ").title()} format', 'success')
-                os.remove(filepath)  # Clean up uploaded file
-                return redirect(url_for('transactions'))
+                # The import inserts into whatever account it is given, so it must be one of the user's
+                account = next((account for account in get_user_accounts() if str(account.id) == str(account_id)), None)
+                if account is None:
+                    raise ValueError("Account not found")
             except Exception as e:
                 flash(f'Error processing file: {str(e)}', 'error')
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+            else:
+                # The import outlives this request, so it needs its own copy of each file
+                filepaths = []
+                for file in files:
+                    # A random name per file, so uploads queued at the same time (from any user)
+                    # never share a path, whatever the files were called
+                    filename = f"{current_user.id}_{uuid.uuid4().hex}.csv"
+                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                    file.save(filepath)
+                    filepaths.append(filepath)
+                
+                # Parsing and inserting can take a while, so the import runs in the background
+                job = ImportJob(
+                    user_id=current_user.id,
+                    account_id=account.id,
+                    formats=', '.join(dict.fromkeys(fmt.replace("_", " ").title() for fmt in formats))
+                )
+                db.session.add(job)
+                db.session.commit()
+                
+                _import_executor.submit(run_import_job, job.id, list(zip(formats, filepaths)),
+                                        account.id, current_user.id)
+                return redirect(url_for('import_status', job_id=job.id))
         else:
             flash('Please upload a CSV file', 'error')
     
-    accounts = Account.query.filter_by(user_id=current_user.id).all()
-    return render_template('upload.html', accounts=accounts)
+    return render_template('upload.html', accounts=get_user_accounts())
+
+
+# One import at a time per process keeps a large upload from starving the web workers
+_import_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='csv-import')
+
+# Imports take seconds; one unfinished this long after upload died with the worker running it
+IMPORT_JOB_TIMEOUT = timedelta(minutes=30)
+
+
+def run_import_job(job_id, files, account_id, user_id):
+    """Import uploaded (format, filepath) CSVs and record the outcome on the job"""
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            # The account was deleted, taking its queued imports with it
+            remove_uploaded_files([filepath for _, filepath in files])
+            return
+        job.status = 'running'
+        db.session.commit()
+        
+        try:
+            # Use appropriate parser; several files are parsed in parallel
+            if len(files) == 1:
+                format_type, filepath = files[0]
+                job.transactions_created = get_parser_by_format(format_type).parse(filepath, account_id, user_id)
+            else:
+                job.transactions_created = parse_files(files, account_id, user_id)
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            remove_uploaded_files([filepath for _, filepath in files])
+
+
+def fail_stale_import_job(job):
+    """Mark a job failed if it is still unfinished IMPORT_JOB_TIMEOUT after upload"""
+    if job.status in ('queued', 'running') and job.created_at < datetime.utcnow() - IMPORT_JOB_TIMEOUT:
+        job.status = 'failed'
+        job.error = 'The import was interrupted. Please upload the file again.'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def remove_uploaded_files(filepaths):
+    """Clean up uploaded files"""
+    for filepath in filepaths:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+@app.route('/upload/status/<int:job_id>')
+@login_required
+def import_status(job_id):
+    job = ImportJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return render_template('import_status.html', job=job)
+
+
+@app.route('/api/import-jobs/<int:job_id>')
+@login_required
+def import_job_status(job_id):
+    try:
+        job = ImportJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+        fail_stale_import_job(job)
+    except OperationalError:
+        # The database is busy (e.g. locked by a large import); the status page just polls again
+        db.session.rollback()
+        return jsonify({'status': 'busy'}), 503
+    
+    return jsonify({
+        'status': job.status,
+        'formats': job.formats,
+        'transactions_created': job.transactions_created,
+        'error': job.error,
+    })
 
 
 @app.route('/budgets')
 @login_required
 def budgets():
-    user_budgets = Budget.query.filter_by(user_id=current_user.id).all()
+    # Plain rows with just the columns the page shows
+    user_budgets = db.session.query(
+        Budget.id,
+        Budget.name,
+        Budget.period_type,
+        Budget.start_date,
+        Budget.end_date,
+        Budget.total_budget,
+        Budget.is_active
+    ).filter(Budget.user_id == current_user.id).all()
     return render_template('budgets.html', budgets=user_budgets)
 
 
@@ -548,8 +840,8 @@ def budgets():
 def add_budget():
     name = request.form['name']
     period_type = request.form['period_type']
-    start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
-    end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+    start_date = date.fromisoformat(request.form['start_date'])
+    end_date = date.fromisoformat(request.form['end_date'])
     total_budget = Decimal(request.form['total_budget'])
     
     budget = Budget(
@@ -571,8 +863,29 @@ def add_budget():
 @app.route('/categories')
 @login_required
 def categories():
-    user_categories = Category.query.filter_by(user_id=current_user.id).all()
-    return render_template('categories.html', categories=user_categories)
+    # One grouped query for every card: the parent's name and a transaction count
+    # come back as columns rather than lazy loads of each category's relationships
+    parent = aliased(Category)
+    user_categories = db.session.query(
+        Category.id,
+        Category.name,
+        Category.color,
+        Category.parent_id,
+        Category.created_at,
+        parent.name.label('parent_name'),
+        func.count(Transaction.id).label('transaction_count')
+    ).outerjoin(parent, Category.parent_id == parent.id)\
+        .outerjoin(Transaction, Transaction.category_id == Category.id)\
+        .filter(Category.user_id == current_user.id)\
+        .group_by(Category.id, parent.name).order_by(Category.name).all()
+    
+    # Subcategory names under each parent
+    subcategories = {}
+    for category in user_categories:
+        if category.parent_id:
+            subcategories.setdefault(category.parent_id, []).append(category.name)
+    
+    return render_template('categories.html', categories=user_categories, subcategories=subcategories)
 
 
 @app.route('/categories/add', methods=['POST'])
@@ -582,84 +895,57 @@ def add_category():
     parent_id = request.form.get('parent_id') or None
     color = request.form.get('color', '#007bff')
     
-    category = Category(
-        user_id=current_user.id,
-        name=name,
-        parent_id=parent_id,
-        color=color
-    )
-    
-    db.session.add(category)
+    category_id = insert_category(current_user.id, name, parent_id, color)
     db.session.commit()
     
-    flash('Category added successfully', 'success')
+    if category_id is None:
+        flash('Category already exists', 'error')
+    else:
+        flash('Category added successfully', 'success')
     return redirect(url_for('categories'))
 
 
+# Start date of each spending chart period, given today's date
+SPENDING_CHART_PERIODS = {
+    'week': lambda today: today - timedelta(days=today.weekday()),  # Monday of this week
+    'month': lambda today: today.replace(day=1),
+    'year': lambda today: today.replace(month=1, day=1),
+    'last_30': lambda today: today - timedelta(days=30),
+    'last_90': lambda today: today - timedelta(days=90),
+}
+
+
 @app.route('/api/spending-chart')
 @login_required
 def spending_chart():
     # Get time period parameter
     period = request.args.get('period', 'month')
     
-    # Calculate date range based on period
-    from datetime import datetime, timedelta
-    
-    today = date.today()
-    
-    if period == 'week':
-        # Current week (Monday to Sunday)
-        days_since_monday = today.weekday()
-        start_date = today - timedelta(days=days_since_monday)
-    elif period == 'month':
-        # Current month
-        start_date = today.replace(day=1)
-    elif period == 'year':
-        # Current year
-        start_date = today.replace(month=1, day=1)
-    elif period == 'last_30':
-        # Last 30 days
-        start_date = today - timedelta(days=30)
-    elif period == 'last_90':
-        # Last 90 days
-        start_date = today - timedelta(days=90)
-    else:
-        # Default to current month
-        start_date = today.replace(day=1)
-    
-    # Build query with date filter
-    query = db.session.query(
-        Category.name,
-        func.sum(Transaction.amount).label('total'),
-        Category.color
-    ).join(Transaction).join(Account).filter(
-        Account.user_id == current_user.id,
-        Transaction.date >= start_date,
-        Transaction.transaction_type == 'expense'
-    ).group_by(Category.name, Category.color)
+    # Calculate date range based on period, defaulting to the current month
+    start_date = SPENDING_CHART_PERIODS.get(period, SPENDING_CHART_PERIODS['month'])(date.today())
     
-    # Handle uncategorized transactions
-    uncategorized_query = db.session.query(
-        func.sum(Transaction.amount).label('total')
-    ).join(Account).filter(
-        Account.user_id == current_user.id,
-        Transaction.date >= start_date,
-        Transaction.transaction_type == 'expense',
-        Transaction.category_id.is_(None)
-    ).scalar()
+    # Browsers revalidate with the ETag and get an empty 304, skipping the aggregation, while the chart is unchanged
+    etag = get_spending_etag(start_date)
+    if etag in request.if_none_match:
+        return spending_chart_response(app.response_class(status=304), etag)
     
-    spending_data = query.all()
+    spending_data = get_category_spending(start_date)
     
     # Prepare chart data
-    labels = [item.name for item in spending_data]
-    data = [float(item.total) for item in spending_data]
-    colors = [item.color for item in spending_data]
-    
-    # Add uncategorized transactions if any
-    if uncategorized_query and float(uncategorized_query) > 0:
-        labels.append('Uncategorized')
-        data.append(float(uncategorized_query))
-        colors.append('#6c757d')  # Gray color for uncategorized
+    labels = []
+    data = []
+    colors = []
+    
+    for item in spending_data:
+        if item.name is not None:
+            labels.append(item.name)
+            data.append(float(item.total))
+            colors.append(item.color)
+        elif item.total > 0:
+            # Add uncategorized transactions if any
+            labels.append('Uncategorized')
+            data.append(float(item.total))
+            colors.append('#6c757d')  # Gray color for uncategorized
     
     chart_data = {
         'labels': labels,
@@ -667,13 +953,21 @@ def spending_chart():
         'colors': colors
     }
     
-    return jsonify(chart_data)
+    return spending_chart_response(jsonify(chart_data), etag)
+
+
+def spending_chart_response(response, etag):
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/categorize')
 @login_required
 def categorize():
     # Get filter parameters
+    page = request.args.get('page', 1, type=int)
     category_filter = request.args.get('category', 'uncategorized')
     account_filter = request.args.get('account')
     date_from = request.args.get('date_from')
@@ -694,20 +988,38 @@ def categorize():
     
     # Apply date filters
     if date_from:
-        query = query.filter(Transaction.date >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        query = query.filter(Transaction.date >= date.fromisoformat(date_from))
     if date_to:
-        query = query.filter(Transaction.date <= datetime.strptime(date_to, '%Y-%m-%d').date())
+        query = query.filter(Transaction.date <= date.fromisoformat(date_to))
     
-    transactions = query.order_by(Transaction.date.desc()).all()
+    # Fill each row's account from the join above rather than a lazy load per row
+    transactions = query.options(contains_eager(Transaction.account))\
+        .order_by(Transaction.date.desc(), Transaction.id.desc()).paginate(page=page, per_page=100, error_out=False)
     
-    # Get categories and accounts for dropdowns
-    categories = Category.query.filter_by(user_id=current_user.id).order_by(Category.name).all()
-    accounts = Account.query.filter_by(user_id=current_user.id).order_by(Account.name).all()
+    # Pagination links keep the current filters
+    filter_args = {key: value for key, value in request.args.items() if key != 'page'}
     
     return render_template('categorize.html', 
                          transactions=transactions,
-                         categories=categories,
-                         accounts=accounts)
+                         filter_args=filter_args,
+                         categories=get_user_categories(),
+                         accounts=get_user_accounts())
+
+
+# Selections the bulk transaction APIs accept, and how many ids go into one IN (...) list
+MAX_BULK_TRANSACTIONS = 1000
+TRANSACTION_ID_BATCH_SIZE = 500
+
+
+def unique_transaction_ids(values):
+    """Distinct transaction ids from a JSON list, in the order given"""
+    return list(dict.fromkeys(int(value) for value in values))
+
+
+def transaction_id_batches(transaction_ids):
+    """Split ids into lists of at most TRANSACTION_ID_BATCH_SIZE"""
+    return [transaction_ids[i:i + TRANSACTION_ID_BATCH_SIZE]
+            for i in range(0, len(transaction_ids), TRANSACTION_ID_BATCH_SIZE)]
 
 
 @app.route('/api/bulk-categorize', methods=['POST'])
@@ -715,26 +1027,30 @@ def categorize():
 def bulk_categorize():
     try:
         data = request.get_json()
-        transaction_ids = data.get('transaction_ids', [])
+        transaction_ids = unique_transaction_ids(data.get('transaction_ids', []))
         category_id = data.get('category_id')
         
         if not transaction_ids:
             return jsonify({'success': False, 'message': 'No transactions selected'})
         
-        # Verify transactions belong to user
-        transactions = Transaction.query.join(Account).filter(
-            Account.user_id == current_user.id,
-            Transaction.id.in_(transaction_ids)
-        ).all()
-        
-        if len(transactions) != len(transaction_ids):
-            return jsonify({'success': False, 'message': 'Invalid transactions selected'})
+        if len(transaction_ids) > MAX_BULK_TRANSACTIONS:
+            return jsonify({'success': False, 'message': f'Select at most {MAX_BULK_TRANSACTIONS} transactions at a time'})
         
-        # Update categories
+        # Update categories, one statement per batch; only the user's own transactions match
         count = 0
-        for transaction in transactions:
-            transaction.category_id = category_id if category_id else None
-            count += 1
+        for batch in transaction_id_batches(transaction_ids):
+            count += Transaction.query.filter(
+                owned_by_current_user(),
+                Transaction.id.in_(batch)
+            ).update(
+                {Transaction.category_id: category_id if category_id else None},
+                synchronize_session=False
+            )
+        
+        # Any id that didn't match isn't the user's, so nothing is changed
+        if count != len(transaction_ids):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Invalid transactions selected'})
         
         db.session.commit()
         
@@ -754,8 +1070,8 @@ def update_category():
         category_id = data.get('category_id')
         
         # Verify transaction belongs to user
-        transaction = Transaction.query.join(Account).filter(
-            Account.user_id == current_user.id,
+        transaction = Transaction.query.filter(
+            owned_by_current_user(),
             Transaction.id == transaction_id
         ).first()
         
@@ -785,28 +1101,19 @@ def create_category_api():
         if not name:
             return jsonify({'success': False, 'message': 'Category name is required'})
         
-        # Check if category already exists
-        existing = Category.query.filter_by(user_id=current_user.id, name=name).first()
-        if existing:
-            return jsonify({'success': False, 'message': 'Category already exists'})
-        
-        # Create category
-        category = Category(
-            user_id=current_user.id,
-            name=name,
-            parent_id=parent_id if parent_id else None,
-            color=color
-        )
-        
-        db.session.add(category)
+        # Create category, unless one by that name already exists
+        category_id = insert_category(current_user.id, name, parent_id if parent_id else None, color)
         db.session.commit()
         
+        if category_id is None:
+            return jsonify({'success': False, 'message': 'Category already exists'})
+        
         return jsonify({
             'success': True,
             'category': {
-                'id': category.id,
-                'name': category.name,
-                'color': category.color
+                'id': category_id,
+                'name': name,
+                'color': color
             }
         })
         
@@ -823,7 +1130,7 @@ def ai_suggest_all():
         # Get all uncategorized transactions for the user
         uncategorized_transactions = Transaction.query.filter_by(
             category_id=None
-        ).join(Account).filter_by(user_id=current_user.id).all()
+        ).filter(owned_by_current_user()).all()
         
         if not uncategorized_transactions:
             return jsonify({'success': False, 'message': 'No uncategorized transactions found'})
@@ -873,7 +1180,7 @@ def apply_suggestions():
             if transaction_id and category_id:
                 transaction = Transaction.query.filter_by(
                     id=transaction_id
-                ).join(Account).filter_by(user_id=current_user.id).first()
+                ).filter(owned_by_current_user()).first()
                 
                 if transaction:
                     transaction.category_id = category_id
@@ -897,11 +1204,14 @@ def ai_suggest_categories():
     """Get AI category suggestions for selected transactions"""
     try:
         data = request.get_json()
-        transaction_ids = data.get('transaction_ids', [])
+        transaction_ids = unique_transaction_ids(data.get('transaction_ids', []))
         
         if not transaction_ids:
             return jsonify({'success': False, 'message': 'No transactions selected'})
         
+        if len(transaction_ids) > MAX_BULK_TRANSACTIONS:
+            return jsonify({'success': False, 'message': f'Select at most {MAX_BULK_TRANSACTIONS} transactions at a time'})
+        
         suggestions = get_categorization_suggestions(transaction_ids, current_user.id)
         
         return jsonify({
@@ -917,8 +1227,16 @@ def ai_suggest_categories():
 @login_required
 def visualizations():
     """Expense visualization dashboard"""
-    accounts = Account.query.filter_by(user_id=current_user.id).order_by(Account.name).all()
-    return render_template('visualizations.html', accounts=accounts)
+    return render_template('visualizations.html', accounts=get_user_accounts())
+
+
+# How far back each visualization period reaches
+VISUALIZATION_PERIODS = {
+    'last_30': timedelta(days=30),
+    'last_90': timedelta(days=90),
+    'last_180': timedelta(days=180),
+    'last_365': timedelta(days=365),
+}
 
 
 @app.route('/api/visualization-data')
@@ -931,44 +1249,32 @@ def visualization_data():
         start_date = request.args.get('start_date', '')
         end_date = request.args.get('end_date', '')
         
-        # Build base query
-        query = Transaction.query.join(Account).filter(
+        # Filters shared by every aggregate; the database does the summing and grouping
+        filters = [
             Account.user_id == current_user.id,
             Transaction.transaction_type == 'expense'
-        )
+        ]
         
         # Apply date filters
-        from datetime import datetime, timedelta
-        
         if period == 'custom' and start_date and end_date:
-            query = query.filter(
-                Transaction.date >= datetime.strptime(start_date, '%Y-%m-%d').date(),
-                Transaction.date <= datetime.strptime(end_date, '%Y-%m-%d').date()
-            )
-        elif period != 'all':
-            days_map = {
-                'last_30': 30,
-                'last_90': 90,
-                'last_180': 180,
-                'last_365': 365
-            }
-            if period in days_map:
-                cutoff_date = datetime.now().date() - timedelta(days=days_map[period])
-                query = query.filter(Transaction.date >= cutoff_date)
+            filters.append(Transaction.date >= date.fromisoformat(start_date))
+            filters.append(Transaction.date <= date.fromisoformat(end_date))
+        elif period in VISUALIZATION_PERIODS:
+            cutoff_date = date.today() - VISUALIZATION_PERIODS[period]
+            filters.append(Transaction.date >= cutoff_date)
         
         # Apply account filter
         if account_id:
-            query = query.filter(Transaction.account_id == account_id)
-        
-        transactions = query.all()
+            filters.append(Transaction.account_id == account_id)
         
         # Process data for different chart types
+        category_breakdown = get_category_breakdown(filters)
         data = {
-            'categories': get_category_breakdown(transactions),
-            'trend': get_spending_trend(transactions),
-            'monthly': get_monthly_comparison(transactions),
-            'accounts': get_account_distribution(transactions),
-            'summary': get_summary_stats(transactions)
+            'categories': category_breakdown,
+            'trend': get_spending_trend(filters),
+            'monthly': get_monthly_comparison(filters),
+            'accounts': get_account_distribution(filters),
+            'summary': get_summary_stats(filters, category_breakdown)
         }
         
         return jsonify({'success': True, 'data': data})
@@ -977,87 +1283,76 @@ def visualization_data():
         return jsonify({'success': False, 'message': str(e)})
 
 
-def get_category_breakdown(transactions):
+def spending_total():
+    """Sum of transaction amounts, cast by the database so rows come back as floats"""
+    return cast(func.sum(Transaction.amount), Float)
+
+
+def get_category_breakdown(filters):
     """Get spending breakdown by category"""
-    category_totals = {}
-    
-    for transaction in transactions:
-        category_name = transaction.category.name if transaction.category else 'Uncategorized'
-        category_totals[category_name] = category_totals.get(category_name, 0) + float(transaction.amount)
+    category_name = func.coalesce(Category.name, 'Uncategorized')
+    total = spending_total()
     
-    # Sort by amount
-    sorted_categories = sorted(category_totals.items(), key=lambda x: x[1], reverse=True)
+    # Sorted by amount
+    rows = db.session.query(category_name, total).select_from(Transaction)\
+        .join(Account).outerjoin(Category).filter(*filters)\
+        .group_by(category_name).order_by(total.desc()).all()
     
     return {
-        'labels': [item[0] for item in sorted_categories],
-        'values': [item[1] for item in sorted_categories]
+        'labels': [name for name, _ in rows],
+        'values': [amount for _, amount in rows]
     }
 
 
-def get_spending_trend(transactions):
+def get_spending_trend(filters):
     """Get daily spending trend"""
-    from collections import defaultdict
-    
-    daily_totals = defaultdict(float)
-    
-    for transaction in transactions:
-        date_str = transaction.date.strftime('%Y-%m-%d')
-        daily_totals[date_str] += float(transaction.amount)
-    
-    # Sort by date
-    sorted_days = sorted(daily_totals.items())
+    rows = db.session.query(Transaction.date, spending_total()).join(Account)\
+        .filter(*filters).group_by(Transaction.date).order_by(Transaction.date).all()
     
     return {
-        'labels': [item[0] for item in sorted_days],
-        'values': [item[1] for item in sorted_days]
+        'labels': [day.strftime('%Y-%m-%d') for day, _ in rows],
+        'values': [amount for _, amount in rows]
     }
 
 
-def get_monthly_comparison(transactions):
+def get_monthly_comparison(filters):
     """Get monthly spending comparison"""
-    from collections import defaultdict
-    
-    monthly_totals = defaultdict(float)
+    year = func.extract('year', Transaction.date)
+    month = func.extract('month', Transaction.date)
     
-    for transaction in transactions:
-        month_key = transaction.date.strftime('%Y-%m')
-        monthly_totals[month_key] += float(transaction.amount)
-    
-    # Sort by month
-    sorted_months = sorted(monthly_totals.items())
+    rows = db.session.query(year, month, spending_total()).join(Account)\
+        .filter(*filters).group_by(year, month).order_by(year, month).all()
     
     # Convert to readable month names
-    labels = []
-    for month_key, _ in sorted_months:
-        month_date = datetime.strptime(month_key, '%Y-%m')
-        labels.append(month_date.strftime('%b %Y'))
-    
     return {
-        'labels': labels,
-        'values': [item[1] for item in sorted_months]
+        'labels': [date(int(y), int(m), 1).strftime('%b %Y') for y, m, _ in rows],
+        'values': [amount for _, _, amount in rows]
     }
 
 
-def get_account_distribution(transactions):
+def get_account_distribution(filters):
     """Get spending distribution by account"""
-    account_totals = {}
-    
-    for transaction in transactions:
-        account_name = transaction.account.name
-        account_totals[account_name] = account_totals.get(account_name, 0) + float(transaction.amount)
+    total = spending_total()
     
-    # Sort by amount
-    sorted_accounts = sorted(account_totals.items(), key=lambda x: x[1], reverse=True)
+    # Sorted by amount
+    rows = db.session.query(Account.name, total).select_from(Transaction).join(Account)\
+        .filter(*filters).group_by(Account.name).order_by(total.desc()).all()
     
     return {
-        'labels': [item[0] for item in sorted_accounts],
-        'values': [item[1] for item in sorted_accounts]
+        'labels': [name for name, _ in rows],
+        'values': [amount for _, amount in rows]
     }
 
 
-def get_summary_stats(transactions):
+def get_summary_stats(filters, category_breakdown):
     """Get summary statistics"""
-    if not transactions:
+    total, first_date, last_date = db.session.query(
+        spending_total(),
+        func.min(Transaction.date),
+        func.max(Transaction.date)
+    ).join(Account).filter(*filters).one()
+    
+    if total is None:
         return {
             'total': 0,
             'avgMonthly': 0,
@@ -1066,30 +1361,37 @@ def get_summary_stats(transactions):
             'categoriesCount': 0
         }
     
-    total = sum(float(t.amount) for t in transactions)
-    
     # Calculate average monthly (assume 30-day months)
-    date_range = (max(t.date for t in transactions) - min(t.date for t in transactions)).days
+    date_range = (last_date - first_date).days
     months = max(1, date_range / 30)
     avg_monthly = total / months
     
     # Top category
-    category_breakdown = get_category_breakdown(transactions)
     top_category = category_breakdown['labels'][0] if category_breakdown['labels'] else None
     top_category_amount = category_breakdown['values'][0] if category_breakdown['values'] else 0
     
-    # Categories count
-    categories_used = set(t.category.name if t.category else 'Uncategorized' for t in transactions)
-    
     return {
         'total': total,
         'avgMonthly': avg_monthly,
         'topCategory': top_category,
         'topCategoryAmount': top_category_amount,
-        'categoriesCount': len(categories_used)
+        'categoriesCount': len(category_breakdown['labels'])
     }
 
 
+def insert_category(user_id, name, parent_id=None, color='#007bff'):
+    """Add a category unless the user has one by that name; returns its id, or None if it exists"""
+    # ON CONFLICT makes the duplicate check and the insert a single atomic statement
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(Category).values(
+        user_id=user_id,
+        name=name,
+        parent_id=parent_id,
+        color=color
+    ).on_conflict_do_nothing(index_elements=['user_id', 'name']).returning(Category.id)
+    return db.session.execute(statement).scalar()
+
+
 def create_default_categories(user_id):
     """Create default categories for new users"""
     default_categories = [
@@ -1105,12 +1407,8 @@ def create_default_categories(user_id):
         {'name': 'Transfer', 'color': '#6c757d'},
     ]
     
-    for cat_data in default_categories:
-        category = Category(
-            user_id=user_id,
-            name=cat_data['name'],
-            color=cat_data['color']
-        )
-        db.session.add(category)
-    
+    # One multi-row INSERT rather than an INSERT per category
+    db.session.bulk_insert_mappings(Category, [
+        dict(cat_data, user_id=user_id) for cat_data in default_categories
+    ])
     db.session.commit()
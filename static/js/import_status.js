@@ -0,0 +1,34 @@
+// Background CSV import status polling
+document.addEventListener('DOMContentLoaded', function() {
+    const statusCard = document.getElementById('importStatus');
+    const statusUrl = statusCard.dataset.statusUrl;
+    const pollInterval = 1000; // 1 second
+    
+    function showResult(message, type, imported) {
+        const importMessage = document.getElementById('importMessage');
+        importMessage.className = `alert alert-${type}`;
+        importMessage.textContent = message;
+        
+        document.getElementById('importProgress').style.display = 'none';
+        document.getElementById('viewTransactions').style.display = imported ? 'inline-block' : 'none';
+        document.getElementById('importResult').style.display = 'block';
+        feather.replace();
+    }
+    
+    function checkStatus() {
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === 'done') {
+                    showResult(`Successfully imported ${job.transactions_created} transactions using ${job.formats} format`, 'success', true);
+                } else if (job.status === 'failed') {
+                    showResult(`Error processing file: ${job.error}`, 'danger', false);
+                } else {
+                    setTimeout(checkStatus, pollInterval);
+                }
+            })
+            .catch(() => setTimeout(checkStatus, pollInterval));
+    }
+    
+    checkStatus();
+});
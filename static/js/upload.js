@@ -34,19 +34,18 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // File input change handler
     fileInput.addEventListener('change', function(e) {
-        const file = e.target.files[0];
-        if (file) {
-            validateFile(file);
+        if (e.target.files.length > 0) {
+            validateFiles(e.target.files);
         }
     });
     
     // Form submission handler
     uploadForm.addEventListener('submit', function(e) {
-        const file = fileInput.files[0];
+        const files = fileInput.files;
         const useExistingAccount = document.getElementById('existing_account').checked;
         const useNewAccount = document.getElementById('new_account').checked;
         
-        if (!file) {
+        if (files.length === 0) {
             e.preventDefault();
             showAlert('Please select a CSV file.', 'error');
             return;
@@ -70,7 +69,7 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         }
         
-        if (!validateFile(file)) {
+        if (!validateFiles(files)) {
             e.preventDefault();
             return;
         }
@@ -84,7 +83,7 @@ document.addEventListener('DOMContentLoaded', function() {
     uploadArea.className = 'upload-area mt-3';
     uploadArea.innerHTML = `
         <i data-feather="upload-cloud" style="width: 48px; height: 48px;" class="text-muted mb-2"></i>
-        <p class="mb-0">Drag and drop your CSV file here, or click to browse</p>
+        <p class="mb-0">Drag and drop your CSV files here, or click to browse</p>
     `;
     
     // Insert upload area after file input
@@ -116,7 +115,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const files = e.dataTransfer.files;
         if (files.length > 0) {
             fileInput.files = files;
-            validateFile(files[0]);
+            validateFiles(files);
         }
     });
     
@@ -124,29 +123,34 @@ document.addEventListener('DOMContentLoaded', function() {
     feather.replace();
 });
 
-function validateFile(file) {
-    const maxSize = 16 * 1024 * 1024; // 16MB
+function validateFiles(files) {
+    const maxSize = 16 * 1024 * 1024; // 16MB for the whole upload
     const allowedTypes = ['text/csv', 'application/vnd.ms-excel'];
+    let totalSize = 0;
     
-    // Check file type
-    if (!allowedTypes.includes(file.type) && !file.name.toLowerCase().endsWith('.csv')) {
-        showAlert('Please select a valid CSV file.', 'error');
-        return false;
+    for (const file of files) {
+        // Check file type
+        if (!allowedTypes.includes(file.type) && !file.name.toLowerCase().endsWith('.csv')) {
+            showAlert('Please select a valid CSV file.', 'error');
+            return false;
+        }
+        totalSize += file.size;
     }
     
     // Check file size
-    if (file.size > maxSize) {
-        showAlert('File size must be less than 16MB.', 'error');
+    if (totalSize > maxSize) {
+        showAlert('Total file size must be less than 16MB.', 'error');
         return false;
     }
     
     // Show file info
-    showFileInfo(file);
+    showFileInfo(files, totalSize);
     return true;
 }
 
-function showFileInfo(file) {
-    const fileSize = (file.size / 1024 / 1024).toFixed(2);
+function showFileInfo(files, totalSize) {
+    const fileSize = (totalSize / 1024 / 1024).toFixed(2);
+    const fileLabel = files.length === 1 ? files[0].name : `${files.length} files`;
     const fileInfo = document.querySelector('.file-info');
     
     if (fileInfo) {
@@ -157,7 +161,7 @@ function showFileInfo(file) {
     infoDiv.className = 'file-info alert alert-info mt-2';
     infoDiv.innerHTML = `
         <i data-feather="file" class="me-2"></i>
-        <strong>${file.name}</strong> (${fileSize} MB)
+        <strong>${fileLabel}</strong> (${fileSize} MB)
     `;
     
     document.querySelector('.upload-area').parentNode.insertBefore(